@@ -1,15 +1,29 @@
-from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from functools import lru_cache
+from itertools import chain
+from operator import itemgetter
 from typing import Optional
 from fastapi import FastAPI, Request, Depends, Form, UploadFile, File
-from fastapi.responses import RedirectResponse, HTMLResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import RedirectResponse, HTMLResponse, StreamingResponse, ORJSONResponse, Response
 from fastapi.templating import Jinja2Templates
-from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, ForeignKey
-from sqlalchemy.orm import sessionmaker, Session, declarative_base, relationship
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import (
+    create_engine, event, inspect, insert, text, func, and_, or_, case, type_coerce,
+    Column, Index, Integer, String, Float, Boolean, DateTime, ForeignKey,
+)
+from sqlalchemy.orm import sessionmaker, Session, Bundle, declarative_base, relationship
 import re
+import glob
+import hashlib
+import os
 import httpx
+import codecs
 import csv
 import io
-import json
+import orjson
 import math
 
 # Safe import for local run and Render
@@ -30,8 +44,28 @@ GOOGLE_CX = "f57f45f72644c493d"
 DATABASE_URL = "sqlite:///tire_simulator.db"
 
 engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False}
+    DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    pool_size=10,
+    max_overflow=20,
+    # Bulk inserts (CSV import, seeding) send up to 1000 rows per statement
+    insertmanyvalues_page_size=1000,
 )
+
+
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets pages read while a write is in progress, and NORMAL sync
+    # is safe under WAL without an fsync on every commit.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=-65536")     # 64 MB page cache
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")   # 256 MB
+    cursor.close()
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -40,6 +74,10 @@ Base = declarative_base()
 CONTAINER_20FT_CBM = 33.0
 CONTAINER_40FT_CBM = 67.0
 
+# Usable CBM per container for the loading estimates on the analysis page
+USABLE_CBM_20 = 28.0
+USABLE_CBM_40 = 68.0
+
 # ---------------------------
 # Dropdown option definitions
 # ---------------------------
@@ -143,6 +181,13 @@ CURRENCY_SYMBOLS = {
     "£": "GBP",
 }
 
+# Compiled once at import; these run per row in CSV import and analysis.
+# The size patterns are anchored at the start only, like re.match, so
+# suffixes such as "280/85R20(11.2R20)" still parse.
+PRICE_RE = re.compile(r"([$€£])\s*(\d[\d,\.]*)")
+METRIC_SIZE_RE = re.compile(r"^(\d{3})/(\d{2})R(\d{2})")
+IMPERIAL_SIZE_RE = re.compile(r"^(\d{1,2}(\.\d)?)-(\d{2})")
+
 
 def extract_price_from_text(text: str):
     """
@@ -154,8 +199,7 @@ def extract_price_from_text(text: str):
     if not text:
         return None, None
 
-    pattern = re.compile(r"(\$|€|£)\s*([0-9][0-9,\.]*)")
-    match = pattern.search(text)
+    match = PRICE_RE.search(text)
     if not match:
         return None, None
 
@@ -171,10 +215,14 @@ def extract_price_from_text(text: str):
     return price_value, currency
 
 
+@lru_cache(maxsize=4096)
 def calculate_tire_cbm(size_string: str):
     """
     Estimate tire volume in CBM from size_string.
 
+    Cached per size string, since the same sizes repeat across brands
+    and CSV rows.
+
     Supports:
       - Metric radial:  480/70R28
       - Imperial bias:  14.9-28
@@ -187,7 +235,7 @@ def calculate_tire_cbm(size_string: str):
     s = size_string.replace(" ", "").upper()
 
     # Metric pattern: 480/70R28
-    metric = re.match(r"(\d{3})/(\d{2})R(\d{2})", s)
+    metric = METRIC_SIZE_RE.match(s)
     if metric:
         width_mm = int(metric.group(1))            # mm
         aspect = int(metric.group(2)) / 100.0      # 70 -> 0.70
@@ -199,7 +247,7 @@ def calculate_tire_cbm(size_string: str):
 
     else:
         # Imperial pattern: 14.9-28 (or 12.4-28, 18.4-30, etc.)
-        imperial = re.match(r"(\d{1,2}(\.\d)?)-(\d{2})", s)
+        imperial = IMPERIAL_SIZE_RE.match(s)
         if imperial:
             width_inch = float(imperial.group(1))
             rim_inch = int(imperial.group(3))
@@ -226,17 +274,37 @@ def calculate_tire_cbm(size_string: str):
     return round(volume_m3, 3)
 
 
+def estimate_container_units(cbm: Optional[float]):
+    """
+    How many tires of the given CBM fit in a 20' and a 40' container.
+
+    Returns (units_20, units_40), or (0, 0) if the CBM is unknown.
+    """
+    if not cbm or cbm <= 0:
+        return 0, 0
+    return int(USABLE_CBM_20 / cbm), int(USABLE_CBM_40 / cbm)
+
+
 # ---------------------------
 # DATABASE MODELS
 # ---------------------------
+def utcnow():
+    """Naive UTC timestamp for updated_at columns."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 class Product(Base):
     __tablename__ = "products"
+    __table_args__ = (
+        # Seed/import duplicate checks by brand (+ size and construction)
+        Index("ix_products_brand_size_rob", "brand", "size_string", "radial_or_bias"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     brand = Column(String, nullable=False)
     model_name = Column(String)
     size_string = Column(String, nullable=False)
-    segment = Column(String)
+    segment = Column(String, index=True)
     category = Column(String)
     radial_or_bias = Column(String)
     load_index = Column(String)
@@ -252,17 +320,54 @@ class Product(Base):
     duty_percent = Column(Float, default=0.0)
 
     # Source country, default Turkiye
-    source_country = Column(String, default="Turkiye")
+    source_country = Column(String, default="Turkiye", index=True)
 
+    # Geometry parsed from size_string (filled by the Lassa seed script)
+    section_width_mm = Column(Float, nullable=True)     # e.g. 420
+    aspect_ratio = Column(Float, nullable=True)         # e.g. 85
+    rim_diameter_inch = Column(Float, nullable=True)    # e.g. 28
+    overall_diameter_mm = Column(Float, nullable=True)  # computed OD
+    cbm_per_tire_estimated = Column(Float, nullable=True)
+
+    # Container loading, derived from tire_cbm whenever the product is saved
+    units_per_20dc_estimated = Column(Integer, nullable=True)
+    units_per_40hc_estimated = Column(Integer, nullable=True)
+
+    # Real loading data from shipments, preferred over the estimates
+    units_per_20dc_manual = Column(Integer, nullable=True)
+    units_per_40hc_manual = Column(Integer, nullable=True)
+
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow, index=True)
+
+    # Left lazy: list pages read offer counts/prices through aggregate
+    # queries, and only delete touches this (for the cascade). Add
+    # .options(selectinload(Product.competitor_prices)) to any query that
+    # iterates it per product.
     competitor_prices = relationship(
         "CompetitorPrice",
         back_populates="product",
         cascade="all, delete-orphan",
     )
 
+    @property
+    def effective_units_per_20dc(self) -> Optional[int]:
+        if self.units_per_20dc_manual is not None:
+            return self.units_per_20dc_manual
+        return self.units_per_20dc_estimated
+
+    @property
+    def effective_units_per_40hc(self) -> Optional[int]:
+        if self.units_per_40hc_manual is not None:
+            return self.units_per_40hc_manual
+        return self.units_per_40hc_estimated
+
 
 class CompetitorPrice(Base):
     __tablename__ = "competitor_prices"
+    __table_args__ = (
+        # Per-product offer lookups and cheapest-offer ranking on /analysis
+        Index("ix_cp_prod_price", "product_id", "selling_price"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
@@ -277,17 +382,69 @@ class CompetitorPrice(Base):
     url = Column(String)
     in_stock = Column(Boolean, default=True)
     notes = Column(String)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow, index=True)
 
     product = relationship("Product", back_populates="competitor_prices")
 
 
+def add_missing_columns():
+    """
+    create_all() only creates missing tables, so add any model columns
+    that an older tire_simulator.db doesn't have yet.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(
+                    text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+                )
+
+
+def create_missing_indexes():
+    """
+    create_all() doesn't add new indexes to tables that already exist.
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
 Base.metadata.create_all(bind=engine)
+add_missing_columns()
+create_missing_indexes()
 
 # ---------------------------
 # FASTAPI SETUP
 # ---------------------------
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled HTTP/2 client for Google searches, so the TLS connection
+    # to googleapis.com is reused instead of set up on every search.
+    app.state.google_client = httpx.AsyncClient(
+        http2=True,
+        timeout=10.0,
+        limits=httpx.Limits(max_keepalive_connections=10),
+    )
+    yield
+    await app.state.google_client.aclose()
+
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+# HTML tables and CSV downloads compress well; tiny responses are left alone
+app.add_middleware(GZipMiddleware, minimum_size=1000, compresslevel=5)
 templates = Jinja2Templates(directory="templates")
+# Compiled templates are cached on disk (in the system temp dir), so a
+# fresh worker skips parsing and compiling them. Templates are checked
+# for changes only on restart.
+templates.env.bytecode_cache = FileSystemBytecodeCache()
+templates.env.auto_reload = False
 
 
 def get_db():
@@ -298,17 +455,70 @@ def get_db():
         db.close()
 
 
+# ---------------------------
+# CONDITIONAL GET (ETAGS)
+# ---------------------------
+# Changes on every deploy of new code or templates, so cached pages
+# rendered by an older version are not revalidated as current.
+PAGE_VERSION = str(
+    max(os.path.getmtime(path) for path in [__file__, *glob.glob("templates/*.html")])
+)
+
+
+def page_etag(db: Session, page: str) -> str:
+    """
+    Weak ETag for a read-only page, derived from the product and offer
+    tables. Any insert, edit or delete changes a count, max id or
+    updated_at, and with it the tag.
+    """
+    product_state = db.query(
+        func.count(Product.id), func.max(Product.id), func.max(Product.updated_at)
+    ).one()
+    offer_state = db.query(
+        func.count(CompetitorPrice.id),
+        func.max(CompetitorPrice.id),
+        func.max(CompetitorPrice.updated_at),
+    ).one()
+    key = f"{page}:{PAGE_VERSION}:{tuple(product_state)}:{tuple(offer_state)}"
+    return f'W/"{hashlib.blake2b(key.encode(), digest_size=8).hexdigest()}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    True if the client's If-None-Match already has this ETag (weak comparison).
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+def cache_headers(etag: str) -> dict:
+    # no-cache: browsers may keep the page but must revalidate it each time
+    return {"ETag": etag, "Cache-Control": "no-cache"}
+
+
+def page_data_if_modified(db: Session, request: Request, page: str, build):
+    """
+    Sync helper for a page route's single threadpool call: returns
+    (etag, None) when the client's copy is current, else (etag, build(db)).
+    """
+    etag = page_etag(db, page)
+    if etag_matches(request, etag):
+        return etag, None
+    return etag, build(db)
+
+
 # ---------------------------
 # HOME & SIMPLE SIMULATOR
 # ---------------------------
-@app.get("/", response_class=HTMLResponse)
-def home(request: Request, db: Session = Depends(get_db)):
-    products = db.query(Product).all()
+@app.get("/", response_class=HTMLResponse, include_in_schema=False)
+async def home(request: Request):
     return templates.TemplateResponse(
         "home.html",
         {
             "request": request,
-            "products": products,
         },
     )
 
@@ -340,10 +550,51 @@ def simulate(
 # ---------------------------
 # PRODUCT CRUD
 # ---------------------------
-@app.get("/products", response_class=HTMLResponse)
-def list_products(request: Request, db: Session = Depends(get_db)):
-    products = db.query(Product).all()
-    return templates.TemplateResponse(
+def list_product_rows(db: Session):
+    """
+    Lightweight rows with just the columns the products table shows,
+    plus each product's number of competitor offers.
+    """
+    offer_counts = (
+        db.query(
+            CompetitorPrice.product_id,
+            func.count(CompetitorPrice.id).label("offers_count"),
+        )
+        .group_by(CompetitorPrice.product_id)
+        .subquery()
+    )
+    return (
+        db.query(
+            Product.id,
+            Product.brand,
+            Product.model_name,
+            Product.size_string,
+            Product.segment,
+            Product.category,
+            Product.radial_or_bias,
+            Product.source_country,
+            Product.exw_price,
+            Product.packing_cost,
+            Product.tire_weight_kg,
+            Product.tire_cbm,
+            Product.currency,
+            func.coalesce(offer_counts.c.offers_count, 0).label("offers_count"),
+        )
+        .outerjoin(offer_counts, offer_counts.c.product_id == Product.id)
+        .order_by(Product.id)
+        .all()
+    )
+
+
+@app.get("/products", response_class=HTMLResponse, include_in_schema=False)
+async def list_products(request: Request, db: Session = Depends(get_db)):
+    etag, products = await run_in_threadpool(
+        page_data_if_modified, db, request, "products", list_product_rows
+    )
+    if products is None:
+        return Response(status_code=304, headers=cache_headers(etag))
+
+    response = templates.TemplateResponse(
         "products.html",
         {
             "request": request,
@@ -355,6 +606,8 @@ def list_products(request: Request, db: Session = Depends(get_db)):
             "country_choices": COUNTRY_CHOICES,
         },
     )
+    response.headers.update(cache_headers(etag))
+    return response
 
 
 @app.post("/products")
@@ -382,6 +635,7 @@ def create_product(
     auto_cbm = calculate_tire_cbm(size_string)
     if (tire_cbm is None or tire_cbm == 0.0) and auto_cbm is not None:
         tire_cbm = auto_cbm
+    units_20, units_40 = estimate_container_units(tire_cbm)
 
     product = Product(
         brand=brand,
@@ -400,6 +654,8 @@ def create_product(
         tire_cbm=tire_cbm,
         duty_percent=duty_percent,
         source_country=source_country or "Turkiye",
+        units_per_20dc_estimated=units_20,
+        units_per_40hc_estimated=units_40,
     )
     db.add(product)
     db.commit()
@@ -407,6 +663,27 @@ def create_product(
     return RedirectResponse(url="/products", status_code=303)
 
 
+# Columns read by the CSV importer, in sample CSV order
+PRODUCT_CSV_COLUMNS = [
+    "brand",
+    "model_name",
+    "size_string",
+    "segment",
+    "category",
+    "radial_or_bias",
+    "load_index",
+    "speed_rating",
+    "ply_rating",
+    "currency",
+    "exw_price",
+    "packing_cost",
+    "tire_weight_kg",
+    "tire_cbm",
+    "duty_percent",
+    "source_country",
+]
+
+
 @app.post("/products/import_csv")
 def import_products_csv(
     file: UploadFile = File(...),
@@ -415,29 +692,58 @@ def import_products_csv(
     """
     Bulk import products from a CSV file.
     """
-    raw_bytes = file.file.read()
-    try:
-        text = raw_bytes.decode("utf-8-sig")
-    except Exception:
-        text = raw_bytes.decode("utf-8", errors="ignore")
-
-    reader = csv.DictReader(io.StringIO(text))
+    # Decode the upload line by line instead of reading it all into memory
+    # (SpooledTemporaryFile can't be wrapped in io.TextIOWrapper before 3.11)
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="ignore")
+    reader = csv.reader(decoder.decode(line) for line in file.file)
+    header = next(reader, None) or []
+
+    # Pick the known columns by position; missing columns read the
+    # empty cell kept at the end of each row
+    width = len(header)
+    positions = {name: i for i, name in enumerate(header)}
+    pick_columns = itemgetter(*(positions.get(name, width) for name in PRODUCT_CSV_COLUMNS))
 
-    created = 0
+    rows = []
     skipped = 0
 
     for row in reader:
-        brand = (row.get("brand") or "").strip()
-        size_string = (row.get("size_string") or "").strip()
+        if not row:
+            continue
+        # Pad short rows and drop extra cells past the header
+        if len(row) < width:
+            row += [""] * (width - len(row))
+        row[width:] = [""]
+
+        (
+            brand,
+            model_name,
+            size_string,
+            segment,
+            category,
+            radial_or_bias,
+            load_index,
+            speed_rating,
+            ply_rating,
+            currency,
+            exw_price,
+            packing_cost,
+            tire_weight_kg,
+            raw_cbm,
+            duty_percent,
+            source_country,
+        ) = pick_columns(row)
+
+        brand = brand.strip()
+        size_string = size_string.strip()
 
         if not brand or not size_string:
             skipped += 1
             continue
 
         # Handle CBM from CSV or auto-calc
-        raw_cbm = row.get("tire_cbm")
         try:
-            tire_cbm_val = float(raw_cbm) if raw_cbm not in (None, "",) else 0.0
+            tire_cbm_val = float(raw_cbm) if raw_cbm else 0.0
         except ValueError:
             tire_cbm_val = 0.0
 
@@ -445,51 +751,102 @@ def import_products_csv(
             auto_cbm = calculate_tire_cbm(size_string)
             if auto_cbm is not None:
                 tire_cbm_val = auto_cbm
+        units_20, units_40 = estimate_container_units(tire_cbm_val)
 
-        product = Product(
-            brand=brand,
-            model_name=(row.get("model_name") or "").strip(),
-            size_string=size_string,
-            segment=(row.get("segment") or "").strip(),
-            category=(row.get("category") or "").strip(),
-            radial_or_bias=(row.get("radial_or_bias") or "").strip(),
-            load_index=(row.get("load_index") or "").strip(),
-            speed_rating=(row.get("speed_rating") or "").strip(),
-            ply_rating=(row.get("ply_rating") or "").strip(),
-            currency=(row.get("currency") or "USD").strip() or "USD",
-            exw_price=float(row.get("exw_price") or 0.0),
-            packing_cost=float(row.get("packing_cost") or 0.0),
-            tire_weight_kg=float(row.get("tire_weight_kg") or 0.0),
-            tire_cbm=tire_cbm_val,
-            duty_percent=float(row.get("duty_percent") or 0.0),
-            source_country=(row.get("source_country") or "Turkiye").strip() or "Turkiye",
+        rows.append(
+            {
+                "brand": brand,
+                "model_name": model_name.strip(),
+                "size_string": size_string,
+                "segment": segment.strip(),
+                "category": category.strip(),
+                "radial_or_bias": radial_or_bias.strip(),
+                "load_index": load_index.strip(),
+                "speed_rating": speed_rating.strip(),
+                "ply_rating": ply_rating.strip(),
+                "currency": currency.strip() or "USD",
+                "exw_price": float(exw_price or 0.0),
+                "packing_cost": float(packing_cost or 0.0),
+                "tire_weight_kg": float(tire_weight_kg or 0.0),
+                "tire_cbm": tire_cbm_val,
+                "duty_percent": float(duty_percent or 0.0),
+                "source_country": source_country.strip() or "Turkiye",
+                "units_per_20dc_estimated": units_20,
+                "units_per_40hc_estimated": units_40,
+            }
         )
 
-        db.add(product)
-        created += 1
-
+    # One executemany INSERT instead of a unit-of-work entry per product
+    if rows:
+        db.execute(insert(Product), rows)
     db.commit()
-    print(f"CSV import complete: created={created}, skipped={skipped}")
+    print(f"CSV import complete: created={len(rows)}, skipped={skipped}")
     return RedirectResponse(url="/products", status_code=303)
 
 
+SAMPLE_CSV_ROWS = [
+    ["Lassa", "IMP-700", "280/70R16", "AG", "Tractor Rear", "Radial", "115", "A8", "8 PR", "USD", "100", "5", "45", "0.25", "4", "Turkiye"],
+    ["Mitas", "AC85", "380/85R28", "AG", "Tractor Rear", "Radial", "142", "A8", "10 PR", "USD", "150", "6", "52", "0.30", "4", "Turkey"],
+    ["BKT", "TR135", "12.4-28", "AG", "Tractor Rear", "Bias", "", "A8", "8 PR", "USD", "120", "5", "48", "0.28", "4", "India"],
+]
+
+
+def iter_csv_lines(rows):
+    """
+    Yield CSV text one record at a time, so downloads stream to the
+    client instead of being built up in memory first.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+# The sample never changes, so it is encoded once at import
+SAMPLE_CSV_BYTES = "".join(iter_csv_lines([PRODUCT_CSV_COLUMNS, *SAMPLE_CSV_ROWS])).encode()
+
+
 @app.get("/products/sample_csv")
 def download_sample_csv():
-    content = """brand,model_name,size_string,segment,category,radial_or_bias,load_index,speed_rating,ply_rating,currency,exw_price,packing_cost,tire_weight_kg,tire_cbm,duty_percent,source_country
-Lassa,IMP-700,280/70R16,AG,Tractor Rear,Radial,115,A8,8 PR,USD,100,5,45,0.25,4,Turkiye
-Mitas,AC85,380/85R28,AG,Tractor Rear,Radial,142,A8,10 PR,USD,150,6,52,0.30,4,Turkey
-BKT,TR135,12.4-28,AG,Tractor Rear,Bias,,A8,8 PR,USD,120,5,48,0.28,4,India
-"""
-    return StreamingResponse(
-        io.StringIO(content),
+    return Response(
+        content=SAMPLE_CSV_BYTES,
         media_type="text/csv",
         headers={"Content-Disposition": "attachment; filename=products_sample.csv"},
     )
 
 
+@app.get("/products/export_csv")
+def export_products_csv():
+    """
+    Download all products in the import CSV format.
+    """
+    def generate():
+        # The response outlives the request's dependencies, so the stream
+        # uses its own session and fetches products in batches of 500.
+        db = SessionLocal()
+        try:
+            products = (
+                db.query(*(getattr(Product, name) for name in PRODUCT_CSV_COLUMNS))
+                .order_by(Product.id)
+                .yield_per(500)
+            )
+            yield from iter_csv_lines(chain([PRODUCT_CSV_COLUMNS], products))
+        finally:
+            db.close()
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/csv",
+        headers={"Content-Disposition": "attachment; filename=products.csv"},
+    )
+
+
 @app.get("/products/{product_id}/edit", response_class=HTMLResponse)
 def edit_product(product_id: int, request: Request, db: Session = Depends(get_db)):
-    product = db.query(Product).filter(Product.id == product_id).first()
+    product = db.get(Product, product_id)
     if not product:
         return RedirectResponse(url="/products", status_code=303)
     return templates.TemplateResponse(
@@ -524,7 +881,7 @@ def update_product(
     source_country: str = Form("Turkiye"),
     db: Session = Depends(get_db),
 ):
-    product = db.query(Product).filter(Product.id == product_id).first()
+    product = db.get(Product, product_id)
     if not product:
         return RedirectResponse(url="/products", status_code=303)
 
@@ -549,6 +906,9 @@ def update_product(
     product.tire_cbm = tire_cbm
     product.duty_percent = duty_percent
     product.source_country = source_country or "Turkiye"
+    product.units_per_20dc_estimated, product.units_per_40hc_estimated = (
+        estimate_container_units(tire_cbm)
+    )
 
     db.commit()
     db.refresh(product)
@@ -557,7 +917,7 @@ def update_product(
 
 @app.post("/products/{product_id}/delete")
 def delete_product(product_id: int, db: Session = Depends(get_db)):
-    product = db.query(Product).filter(Product.id == product_id).first()
+    product = db.get(Product, product_id)
     if product:
         db.delete(product)
         db.commit()
@@ -574,10 +934,11 @@ def competitors_page(
     db: Session = Depends(get_db),
 ):
     if product_id is not None:
-        product = db.query(Product).filter(Product.id == product_id).first()
+        product = db.get(Product, product_id)
         competitors = (
             db.query(CompetitorPrice)
             .filter(CompetitorPrice.product_id == product_id)
+            .order_by(CompetitorPrice.id)
             .all()
         )
     else:
@@ -635,11 +996,7 @@ def edit_competitor(
     request: Request,
     db: Session = Depends(get_db),
 ):
-    competitor = (
-        db.query(CompetitorPrice)
-        .filter(CompetitorPrice.id == competitor_id)
-        .first()
-    )
+    competitor = db.get(CompetitorPrice, competitor_id)
     if not competitor:
         return RedirectResponse(url="/products", status_code=303)
 
@@ -669,11 +1026,7 @@ def update_competitor(
     notes: str = Form(""),
     db: Session = Depends(get_db),
 ):
-    competitor = (
-        db.query(CompetitorPrice)
-        .filter(CompetitorPrice.id == competitor_id)
-        .first()
-    )
+    competitor = db.get(CompetitorPrice, competitor_id)
     if not competitor:
         return RedirectResponse(url="/products", status_code=303)
 
@@ -699,11 +1052,7 @@ def delete_competitor(
     competitor_id: int,
     db: Session = Depends(get_db),
 ):
-    competitor = (
-        db.query(CompetitorPrice)
-        .filter(CompetitorPrice.id == competitor_id)
-        .first()
-    )
+    competitor = db.get(CompetitorPrice, competitor_id)
     if competitor:
         product_id = competitor.product_id
         db.delete(competitor)
@@ -725,7 +1074,7 @@ def import_competitor_from_search(
     notes: str = Form(""),
     db: Session = Depends(get_db),
 ):
-    product = db.query(Product).filter(Product.id == product_id).first()
+    product = db.get(Product, product_id)
     if not product:
         return RedirectResponse(url="/products", status_code=303)
 
@@ -756,112 +1105,162 @@ def import_competitor_from_search(
 # ---------------------------
 # OPPORTUNITY ANALYSIS
 # ---------------------------
-@app.get("/analysis", response_class=HTMLResponse)
-def analysis(request: Request, db: Session = Depends(get_db)):
-    products = db.query(Product).order_by(Product.brand, Product.size_string).all()
-    rows = []
+def build_analysis_rows(db: Session):
+    """
+    Build one row per product with its best competitor offer,
+    factory cost, margin and container loading.
+    """
+    # Only offers with a price count towards the analysis. One pass over
+    # the offers ranks them by price within each product (rank 1 is the
+    # best offer) and counts them alongside.
+    by_product = CompetitorPrice.product_id
+    ranked_offers = (
+        db.query(
+            CompetitorPrice.product_id,
+            CompetitorPrice.source_name,
+            CompetitorPrice.competitor_brand,
+            CompetitorPrice.region,
+            CompetitorPrice.selling_price,
+            CompetitorPrice.currency,
+            func.row_number()
+            .over(
+                partition_by=by_product,
+                order_by=(CompetitorPrice.selling_price, CompetitorPrice.id),
+            )
+            .label("price_rank"),
+            func.count().over(partition_by=by_product).label("offers_count"),
+            func.max(CompetitorPrice.in_stock).over(partition_by=by_product).label("any_in_stock"),
+        )
+        .filter(CompetitorPrice.selling_price > 0)
+        .subquery()
+    )
 
-    # approximate usable CBM per container
-    CBM_20 = 28.0   # adjust later if you want
-    CBM_40 = 68.0
-
-    for p in products:
-        offers = p.competitor_prices or []
-        valid_offers = [o for o in offers if (o.selling_price or 0) > 0]
-
-        if valid_offers:
-            best_offer = min(valid_offers, key=lambda o: o.selling_price)
-            best_comp_name = best_offer.competitor_brand or best_offer.source_name
-            best_comp_region = best_offer.region or ""
-            best_price = best_offer.selling_price
-            best_currency = best_offer.currency
-            offers_count = len(valid_offers)
-            any_in_stock = any(o.in_stock for o in valid_offers)
-        else:
-            best_offer = None
-            best_comp_name = None
-            best_comp_region = ""
-            best_price = None
-            best_currency = None
-            offers_count = 0
-            any_in_stock = False
-
-        factory_cost = (p.exw_price or 0.0) + (p.packing_cost or 0.0)
-
-        profit_per_tire = None
-        margin_percent = None
-        if best_price is not None and best_price > 0:
-            if not best_currency or best_currency == (p.currency or "USD"):
-                profit_per_tire = best_price - factory_cost
-                if best_price != 0:
-                    margin_percent = (profit_per_tire / best_price) * 100.0
-
-        # --- CBM + container units ---
-        cbm = p.tire_cbm
-        if not cbm or cbm <= 0:
-            cbm = calculate_tire_cbm(p.size_string) or 0.0
-
-        units_20 = int(CBM_20 / cbm) if cbm > 0 else 0
-        units_40 = int(CBM_40 / cbm) if cbm > 0 else 0
+    # Only the product columns the page shows, grouped so each result row
+    # still exposes them as row.product (a light Row, not an ORM instance)
+    product_columns = Bundle(
+        "product",
+        Product.id,
+        Product.brand,
+        Product.size_string,
+        Product.segment,
+        Product.currency,
+    )
+    best_price = ranked_offers.c.selling_price
+    best_currency = ranked_offers.c.currency
+    factory_cost = func.coalesce(Product.exw_price, 0.0) + func.coalesce(Product.packing_cost, 0.0)
+
+    # Profit and margin only when the offer is in the product's currency
+    comparable = and_(
+        best_price > 0,
+        or_(
+            func.coalesce(best_currency, "") == "",
+            best_currency == func.coalesce(func.nullif(Product.currency, ""), "USD"),
+        ),
+    )
 
-        rows.append(
-            {
-                "product": p,
-                "offers_count": offers_count,
-                "best_comp_name": best_comp_name,
-                "best_comp_region": best_comp_region,
-                "best_currency": best_currency,
-                "best_price": best_price,
-                "factory_cost": factory_cost,
-                "profit_per_tire": profit_per_tire,
-                "margin_percent": margin_percent,
-                "any_in_stock": any_in_stock,
-                "cbm_per_tire": cbm,
-                "units_20": units_20,
-                "units_40": units_40,
-            }
+    results = (
+        db.query(
+            product_columns,
+            func.coalesce(ranked_offers.c.offers_count, 0).label("offers_count"),
+            func.coalesce(
+                func.nullif(ranked_offers.c.competitor_brand, ""),
+                ranked_offers.c.source_name,
+            ).label("best_comp_name"),
+            func.coalesce(ranked_offers.c.region, "").label("best_comp_region"),
+            best_currency.label("best_currency"),
+            best_price.label("best_price"),
+            factory_cost.label("factory_cost"),
+            case((comparable, best_price - factory_cost)).label("profit_per_tire"),
+            case((comparable, (best_price - factory_cost) / best_price * 100.0)).label("margin_percent"),
+            type_coerce(func.coalesce(ranked_offers.c.any_in_stock, False), Boolean).label("any_in_stock"),
+            func.coalesce(Product.tire_cbm, 0.0).label("cbm_per_tire"),
+            Product.units_per_20dc_estimated.label("units_20"),
+            Product.units_per_40hc_estimated.label("units_40"),
         )
+        .outerjoin(
+            ranked_offers,
+            and_(
+                ranked_offers.c.product_id == Product.id,
+                ranked_offers.c.price_rank == 1,
+            ),
+        )
+        .order_by(Product.brand, Product.size_string, Product.id)
+        .all()
+    )
 
-    return templates.TemplateResponse(
+    rows = [result._asdict() for result in results]
+
+    # --- CBM + container units (stored when the product is saved) ---
+    for row in rows:
+        if row["cbm_per_tire"] <= 0 or row["units_20"] is None or row["units_40"] is None:
+            # No usable CBM stored, or saved before units were stored
+            if row["cbm_per_tire"] <= 0:
+                row["cbm_per_tire"] = calculate_tire_cbm(row["product"].size_string) or 0.0
+            row["units_20"], row["units_40"] = estimate_container_units(row["cbm_per_tire"])
+
+    return rows
+
+
+@app.get("/analysis", response_class=HTMLResponse, include_in_schema=False)
+async def analysis(request: Request, db: Session = Depends(get_db)):
+    etag, rows = await run_in_threadpool(
+        page_data_if_modified, db, request, "analysis", build_analysis_rows
+    )
+    if rows is None:
+        return Response(status_code=304, headers=cache_headers(etag))
+
+    response = templates.TemplateResponse(
         "analysis.html",
         {
             "request": request,
             "rows": rows,
         },
     )
+    response.headers.update(cache_headers(etag))
+    return response
 
 
 
 # ---------------------------
 # DASHBOARD (CHARTS)
 # ---------------------------
-@app.get("/dashboard", response_class=HTMLResponse)
-def dashboard(request: Request, db: Session = Depends(get_db)):
-    products = db.query(Product).all()
+def build_dashboard_context(db: Session):
+    """
+    Aggregate product counts and prices into JSON arrays for Chart.js.
+    """
+    # Everything is aggregated in SQL. Empty values are folded into
+    # "Unspecified" before grouping, and ordering by the first product id
+    # keeps labels in the order the products were added.
+    first_seen = func.min(Product.id)
+    segment_label = func.coalesce(func.nullif(Product.segment, ""), "Unspecified")
+    country_label = func.coalesce(func.nullif(Product.source_country, ""), "Unspecified")
 
     # --- BASIC COUNTS ---
 
     # Products by segment
-    segment_counts = Counter(p.segment or "Unspecified" for p in products)
+    segment_counts = dict(
+        db.query(segment_label, func.count(Product.id))
+        .group_by(segment_label)
+        .order_by(first_seen)
+        .all()
+    )
 
     # Products by source country
-    country_counts = Counter(p.source_country or "Unspecified" for p in products)
+    country_counts = dict(
+        db.query(country_label, func.count(Product.id))
+        .group_by(country_label)
+        .order_by(first_seen)
+        .all()
+    )
 
     # --- AVERAGE EXW PRICE BY SEGMENT ---
-    price_sum = defaultdict(float)
-    price_count = defaultdict(int)
-
-    for p in products:
-        seg = p.segment or "Unspecified"
-        if p.exw_price and p.exw_price > 0:
-            price_sum[seg] += p.exw_price
-            price_count[seg] += 1
-
-    segment_avg_price = {
-        seg: (price_sum[seg] / price_count[seg])
-        for seg in price_sum
-        if price_count[seg] > 0
-    }
+    segment_avg_price = dict(
+        db.query(segment_label, func.avg(Product.exw_price))
+        .filter(Product.exw_price > 0)
+        .group_by(segment_label)
+        .order_by(first_seen)
+        .all()
+    )
 
     # Prepare simple arrays for Chart.js
     segment_labels = list(segment_counts.keys())
@@ -873,18 +1272,33 @@ def dashboard(request: Request, db: Session = Depends(get_db)):
     avg_seg_labels = list(segment_avg_price.keys())
     avg_seg_values = [round(v, 2) for v in segment_avg_price.values()]
 
-    return templates.TemplateResponse(
+    return {
+        "segment_labels_json": orjson.dumps(segment_labels).decode(),
+        "segment_values_json": orjson.dumps(segment_values).decode(),
+        "country_labels_json": orjson.dumps(country_labels).decode(),
+        "country_values_json": orjson.dumps(country_values).decode(),
+        "avg_seg_labels_json": orjson.dumps(avg_seg_labels).decode(),
+        "avg_seg_values_json": orjson.dumps(avg_seg_values).decode(),
+    }
+
+
+@app.get("/dashboard", response_class=HTMLResponse, include_in_schema=False)
+async def dashboard(request: Request, db: Session = Depends(get_db)):
+    etag, context = await run_in_threadpool(
+        page_data_if_modified, db, request, "dashboard", build_dashboard_context
+    )
+    if context is None:
+        return Response(status_code=304, headers=cache_headers(etag))
+
+    response = templates.TemplateResponse(
         "dashboard.html",
         {
             "request": request,
-            "segment_labels_json": json.dumps(segment_labels),
-            "segment_values_json": json.dumps(segment_values),
-            "country_labels_json": json.dumps(country_labels),
-            "country_values_json": json.dumps(country_values),
-            "avg_seg_labels_json": json.dumps(avg_seg_labels),
-            "avg_seg_values_json": json.dumps(avg_seg_values),
+            **context,
         },
     )
+    response.headers.update(cache_headers(etag))
+    return response
 
 
 # ---------------------------
@@ -896,7 +1310,7 @@ def auto_fetch_prices(
     request: Request,
     db: Session = Depends(get_db),
 ):
-    product = db.query(Product).filter(Product.id == product_id).first()
+    product = db.get(Product, product_id)
     if not product:
         return RedirectResponse("/products", status_code=303)
 
@@ -922,12 +1336,12 @@ def auto_fetch_prices(
 # AUTO GOOGLE COMPETITOR SEARCH
 # ---------------------------
 @app.get("/products/{product_id}/find_competitors", response_class=HTMLResponse)
-def find_competitors(
+async def find_competitors(
     product_id: int,
     request: Request,
     db: Session = Depends(get_db),
 ):
-    product = db.query(Product).filter(Product.id == product_id).first()
+    product = await run_in_threadpool(db.get, Product, product_id)
     if not product:
         return RedirectResponse("/products", status_code=303)
 
@@ -941,7 +1355,8 @@ def find_competitors(
         "num": 10,
     }
 
-    response = httpx.get(url, params=params)
+    # Async client so the event loop isn't blocked on the Google API round trip
+    response = await request.app.state.google_client.get(url, params=params)
     data = response.json()
     items = data.get("items", [])
 
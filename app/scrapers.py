@@ -4,11 +4,14 @@ from dataclasses import dataclass
 from typing import List, Optional
 
 
-@dataclass
+@dataclass(frozen=True)
 class ScrapedOffer:
     """
     Minimal structure for a scraped competitor offer.
     We can expand this later when real scrapers are ready.
+
+    Immutable and hashable, so offers can be deduplicated with a set;
+    use dataclasses.replace() to derive a changed copy.
     """
     source: str          # e.g. "SimpleTire", "FarmTireWarehouse"
     title: str           # Product title from the site
@@ -6,15 +6,41 @@
 #
 # This will insert Lassa AG products into the SAME tire_simulator.db used by FastAPI.
 
+import hashlib
+import io
+import math
+import os
+import pickle
 import re
+from itertools import islice
 
-from app.main import SessionLocal, Product  # IMPORTANT: from app.main
+from sqlalchemy import insert, select, text
+
+from app.main import engine, Product  # IMPORTANT: from app.main
 from app.utils import (
-    estimate_geometry_and_cbm,
-    estimate_units_per_container,
+    estimate_geometry_and_cbm_batch,
+    estimate_units_per_container_batch,
 )
 
 
+# Part of the parsed-rows cache key (see load_lassa_row_batches)
+SEED_CACHE_VERSION = 2
+
+# Lines parsed, estimated and inserted per batch
+SEED_BATCH_SIZE = 500
+
+_PLY_RE = re.compile(r"(\d+PR)")
+
+# Classification keywords -> (radial_or_bias, category), checked in this
+# priority order; the first keyword found in the text wins.
+_LINE_CLASSES = {
+    "radial": ("Radial", "Tractor Rear"),
+    "trailer / implement": ("Bias", "Implement"),
+    "bias (front)": ("Bias", "Tractor Front"),
+    "bias": ("Bias", "Tractor Rear"),
+}
+
+
 RAW_LASSA_LIST = """
 250/85R24 — Radial
 280/70R16 — Radial
@@ -109,34 +135,20 @@ def classify_line(line: str):
     else:
         left, right = line, ""
 
-    left = left.strip()
-    right = right.strip()
-
     # size_string = first token on the left (before any space)
     size_string = left.split()[0]
 
     # ply rating if present, e.g. (6PR) or (14PR)
-    ply_match = re.search(r"(\d+PR)", left)
+    ply_match = _PLY_RE.search(left)
     ply_rating = ply_match.group(1) if ply_match else ""
 
-    right_lower = right.lower()
-
     # Construction & category rules
-    if "radial" in right_lower:
-        radial_or_bias = "Radial"
-        category = "Tractor Rear"
-    elif "trailer / implement" in right_lower:
-        radial_or_bias = "Bias"
-        category = "Implement"
-    elif "bias (front)" in right_lower:
-        radial_or_bias = "Bias"
-        category = "Tractor Front"
-    elif "bias" in right_lower:
-        radial_or_bias = "Bias"
-        category = "Tractor Rear"
-    else:
-        radial_or_bias = "Bias"
-        category = "Tractor Rear"
+    right_lower = right.lower()
+    radial_or_bias, category = "Bias", "Tractor Rear"
+    for keyword, line_class in _LINE_CLASSES.items():
+        if keyword in right_lower:
+            radial_or_bias, category = line_class
+            break
 
     return {
         "size_string": size_string,
@@ -146,76 +158,175 @@ def classify_line(line: str):
     }
 
 
+def _iter_parsed(raw: str):
+    """Yield classify_line() for each non-blank line, without splitting up front."""
+    for line in io.StringIO(raw):
+        line = line.strip()
+        if line:
+            yield classify_line(line)
+
+
+def build_lassa_rows(parsed):
+    """
+    Estimate geometry for a batch of classified lines.
+    Returns one Product row dict per line (no DB access).
+    """
+    # --- NEW: compute geometry + cbm + container loading in one go ---
+    geo_arrays = estimate_geometry_and_cbm_batch([data["size_string"] for data in parsed])
+    units_arrays = estimate_units_per_container_batch(geo_arrays["cbm_per_tire"])
+
+    # NaN / -1 (no usable size) become None, as the scalar estimators return
+    geo_columns = {
+        key: [None if math.isnan(v) else v for v in values.tolist()]
+        for key, values in geo_arrays.items()
+    }
+    units_20_column, units_40_column = (
+        [None if u < 0 else u for u in values.tolist()]
+        for values in units_arrays
+    )
+
+    rows = []
+    for i, data in enumerate(parsed):
+        geo = {key: values[i] for key, values in geo_columns.items()}
+        units_20, units_40 = units_20_column[i], units_40_column[i]
+
+        rows.append({
+            "brand": "Lassa",
+            "model_name": "",           # pattern name can be added later
+            "size_string": data["size_string"],
+            "segment": "AG",            # agricultural line
+            "category": data["category"],
+            "radial_or_bias": data["radial_or_bias"],
+            "load_index": "",           # unknown here
+            "speed_rating": "",         # unknown here
+            "ply_rating": data["ply_rating"],
+            "currency": "USD",          # default for now
+
+            # cost fields (placeholders for now)
+            "exw_price": 0.0,
+            "packing_cost": 0.0,
+            "tire_weight_kg": 0.0,
+
+            # OLD: if you still use tire_cbm, keep it in sync with estimate
+            "tire_cbm": geo["cbm_per_tire"] or 0.0,
+
+            "duty_percent": 0.0,
+            "source_country": "Turkiye",
+
+            # NEW logistics fields
+            "section_width_mm": geo["section_width_mm"],
+            "aspect_ratio": geo["aspect_ratio"],
+            "rim_diameter_inch": geo["rim_diameter_inch"],
+            "overall_diameter_mm": geo["overall_diameter_mm"],
+            "cbm_per_tire_estimated": geo["cbm_per_tire"],
+            "units_per_20dc_estimated": units_20,
+            "units_per_40hc_estimated": units_40,
+        })
+    return rows
+
+
+def iter_lassa_row_batches(batch_size: int = SEED_BATCH_SIZE):
+    """Stream RAW_LASSA_LIST as lists of at most batch_size row dicts."""
+    parsed = _iter_parsed(RAW_LASSA_LIST)
+    while batch := list(islice(parsed, batch_size)):
+        yield build_lassa_rows(batch)
+
+
+def _read_cached_batches(cache_path: str):
+    """
+    All batches from a load_lassa_row_batches() cache file, or None if it is
+    missing or unreadable. A corrupt file is deleted so it gets rebuilt; it
+    is read in full first, so a bad file never yields a partial seed.
+    """
+    try:
+        with open(cache_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            batches = []
+            while f.tell() < size:
+                batch = pickle.load(f)
+                if not isinstance(batch, list):
+                    raise pickle.UnpicklingError("cached batch is not a list of rows")
+                batches.append(batch)
+        if not batches:
+            raise pickle.UnpicklingError("empty cache file")
+        return batches
+    except OSError:
+        return None
+    except Exception:
+        # Truncated or garbled pickles fail in many ways (UnpicklingError,
+        # EOFError mid-record, ValueError, ...); any of them means rebuild
+        try:
+            os.remove(cache_path)
+        except OSError:
+            pass
+        return None
+
+
+def load_lassa_row_batches():
+    """
+    iter_lassa_row_batches(), pickled batch by batch next to this script and
+    keyed on the list text, so re-seeding skips parsing and geometry unless
+    the list changes.
+    Bump SEED_CACHE_VERSION when classify_line or the row layout changes.
+    """
+    key = hashlib.sha1(
+        f"{SEED_CACHE_VERSION}\n{RAW_LASSA_LIST}".encode("utf-8")
+    ).hexdigest()
+    cache_dir = os.path.dirname(os.path.abspath(__file__))
+    cache_path = os.path.join(cache_dir, f"seed_lassa_{key}.pkl")
+
+    cached = _read_cached_batches(cache_path)
+    if cached is not None:
+        yield from cached
+        return
+
+    # Written under a temporary name and renamed once complete, so an
+    # interrupted run never leaves a truncated cache behind
+    partial_path = os.path.join(cache_dir, f"seed_lassa_{key}.partial.pkl")
+    with open(partial_path, "wb") as f:
+        for batch in iter_lassa_row_batches():
+            pickle.dump(batch, f, protocol=pickle.HIGHEST_PROTOCOL)
+            yield batch
+    os.replace(partial_path, cache_path)
+
+
 def seed_lassa_products():
-    db = SessionLocal()
-    created = 0
-    skipped = 0
+    # Plain Core connection: rows go straight to executemany, with no
+    # Session / identity map bookkeeping around them
+    conn = engine.connect()
 
     try:
-        for raw_line in RAW_LASSA_LIST.splitlines():
-            line = raw_line.strip()
-            if not line:
-                continue
-
-            data = classify_line(line)
-
-            # Check if this product already exists (avoid duplicates)
-            existing = (
-                db.query(Product)
-                .filter(
-                    Product.brand == "Lassa",
-                    Product.size_string == data["size_string"],
-                    Product.radial_or_bias == data["radial_or_bias"],
-                )
-                .first()
-            )
-            if existing:
-                skipped += 1
-                continue
-
-            # --- NEW: compute geometry + cbm + container loading ---
-            geo = estimate_geometry_and_cbm(data["size_string"])
-            units_20, units_40 = estimate_units_per_container(geo["cbm_per_tire"])
-
-            p = Product(
-                brand="Lassa",
-                model_name="",           # pattern name can be added later
-                size_string=data["size_string"],
-                segment="AG",            # agricultural line
-                category=data["category"],
-                radial_or_bias=data["radial_or_bias"],
-                load_index="",           # unknown here
-                speed_rating="",         # unknown here
-                ply_rating=data["ply_rating"],
-                currency="USD",          # default for now
-
-                # cost fields (placeholders for now)
-                exw_price=0.0,
-                packing_cost=0.0,
-                tire_weight_kg=0.0,
-
-                # OLD: if you still use tire_cbm, keep it in sync with estimate
-                tire_cbm=geo["cbm_per_tire"] or 0.0,
-
-                duty_percent=0.0,
-                source_country="Turkiye",
-
-                # NEW logistics fields from models.py
-                section_width_mm=geo["section_width_mm"],
-                aspect_ratio=geo["aspect_ratio"],
-                rim_diameter_inch=geo["rim_diameter_inch"],
-                overall_diameter_mm=geo["overall_diameter_mm"],
-                cbm_per_tire_estimated=geo["cbm_per_tire"],
-                units_per_20dc_estimated=units_20,
-                units_per_40hc_estimated=units_40,
-            )
-            db.add(p)
-            created += 1
-
-        db.commit()
+        # One-off bulk load: skip the per-commit fsync on this connection.
+        # WAL is already enabled for every connection by app.main.
+        conn.execute(text("PRAGMA synchronous=OFF"))
+
+        # Lassa products already in the DB, fetched once instead of one
+        # SELECT per line (avoid duplicates)
+        existing = frozenset(
+            conn.execute(
+                select(Product.size_string, Product.radial_or_bias)
+                .where(Product.brand == "Lassa")
+            ).tuples()
+        )
+
+        # One INSERT per batch, all inside this connection's transaction
+        created = skipped = 0
+        for batch in load_lassa_row_batches():
+            rows = [
+                row for row in batch
+                if (row["size_string"], row["radial_or_bias"]) not in existing
+            ]
+            skipped += len(batch) - len(rows)
+            if rows:
+                conn.execute(insert(Product), rows)
+                created += len(rows)
+        conn.commit()
         print(f"Done. Created {created} products, skipped {skipped} already existing.")
     finally:
-        db.close()
+        # Connections go back to the shared pool, so restore the app default
+        conn.rollback()
+        conn.execute(text("PRAGMA synchronous=NORMAL"))
+        conn.close()
 
 
 if __name__ == "__main__":